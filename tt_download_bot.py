@@ -2,15 +2,21 @@ import asyncio
 import logging
 import os
 import re
-import uuid
-import time
+import secrets
+from contextlib import suppress
+from concurrent.futures import ThreadPoolExecutor
 from dataclasses import dataclass
-from typing import Optional, List, Dict
+from typing import Optional, List, Dict, MutableMapping, Tuple
 
+import aiofiles
+import aiohttp
 from aiogram import Bot, Dispatcher
 from aiogram.client.default import DefaultBotProperties
+from aiogram.client.session.aiohttp import AiohttpSession
 from aiogram.enums import ParseMode
+from aiogram.exceptions import TelegramBadRequest
 from aiogram.filters import CommandStart
+from aiogram.filters.callback_data import CallbackData
 from aiogram.types import (
     Message,
     CallbackQuery,
@@ -18,6 +24,7 @@ from aiogram.types import (
     InlineKeyboardButton,
     FSInputFile,
 )
+from cachetools import TTLCache
 from dotenv import load_dotenv
 import yt_dlp
 
@@ -27,10 +34,15 @@ load_dotenv()
 BOT_TOKEN = os.getenv("BOT_TOKEN", "")
 DOWNLOAD_DIR = os.getenv("DOWNLOAD_DIR", "downloads")
 LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO")
+YDL_WORKERS_RAW = os.getenv("YDL_WORKERS", "4")
 
 if not BOT_TOKEN:
     raise RuntimeError("BOT_TOKEN отсутствует в .env")
 
+if not YDL_WORKERS_RAW.isdigit() or int(YDL_WORKERS_RAW) < 1:
+    raise RuntimeError("YDL_WORKERS в .env должен быть целым числом больше нуля")
+YDL_WORKERS = int(YDL_WORKERS_RAW)
+
 os.makedirs(DOWNLOAD_DIR, exist_ok=True)
 
 logging.basicConfig(
@@ -41,139 +53,344 @@ logger = logging.getLogger("universal_media_bot")
 
 
 # === Регулярные выражения для поддерживаемых платформ ===
+# Хвост ссылки — печатные ASCII-символы: ссылка заканчивается на пробеле или
+# первом не-ASCII символе (кириллица, «», неразрывный пробел)
 URL_PATTERNS = {
-    "tiktok": re.compile(r"(https?://(?:www\.)?(?:tiktok\.com|vm\.tiktok\.com)/[^\s]+)"),
-    "youtube": re.compile(r"(https?://(?:www\.)?(?:youtube\.com|youtu\.be)/[^\s]+)"),
-    "instagram": re.compile(r"(https?://(?:www\.)?instagram\.com/[^\s]+)"),
-    "vk": re.compile(r"(https?://(?:www\.)?vk\.com/video[^\s]+)"),
-    "pinterest": re.compile(r"(https?://(?:www\.)?pinterest\.[^\s]+)"),
+    "tiktok": re.compile(r"(https?://(?:www\.)?(?:tiktok\.com|vm\.tiktok\.com)/[!-~]+)", re.ASCII),
+    "youtube": re.compile(r"(https?://(?:www\.)?(?:youtube\.com|youtu\.be)/[!-~]+)", re.ASCII),
+    "instagram": re.compile(r"(https?://(?:www\.)?instagram\.com/[!-~]+)", re.ASCII),
+    "vk": re.compile(r"(https?://(?:www\.)?vk\.com/video[!-~]+)", re.ASCII),
+    "pinterest": re.compile(r"(https?://(?:www\.)?pinterest\.[!-~]+)", re.ASCII),
+}
+
+PLATFORM_NAMES = {
+    "tiktok": "TikTok",
+    "youtube": "YouTube",
+    "instagram": "Instagram",
+    "vk": "VK",
+    "pinterest": "Pinterest",
 }
 
+# Все шаблоны одним выражением: платформа определяется по имени сработавшей группы
+URL_COMBINED = re.compile(
+    "|".join(f"(?P<{key}>{pattern.pattern})" for key, pattern in URL_PATTERNS.items()),
+    re.ASCII,
+)
+
 
 # === Модель данных ===
 @dataclass
 class VideoInfo:
     url: str
     title: str
-    formats: List[dict]
+    formats: List[Tuple[str, int]]  # (format_id, высота) видеоформатов mp4
+
+
+# === Callback-данные кнопок ===
+class TypeCB(CallbackData, prefix="t"):
+    media_type: str
+    uid: str
+
+
+class DlCB(CallbackData, prefix="d"):
+    media_type: str
+    fmt_id: str
+    uid: str
 
 
 # === Временный кеш ссылок (id → url, с TTL) ===
-URL_CACHE: Dict[str, dict] = {}
 CACHE_TTL = 15 * 60  # 15 минут
+# Записи хранят метаданные yt-dlp (десятки КБ даже после очистки), поэтому лимит скромный
+URL_CACHE: MutableMapping[str, dict] = TTLCache(maxsize=1_000, ttl=CACHE_TTL)
+
+# Ключи метаданных, которые не нужны для загрузки и только занимают память в кеше
+UNUSED_INFO_KEYS = ("automatic_captions", "subtitles", "thumbnails", "heatmap")
+
+# === Кеш отправленных файлов ((url, формат, тип) → file_id в Telegram) ===
+FILE_CACHE_TTL = 24 * 60 * 60  # сутки
+FILE_CACHE: MutableMapping[Tuple[str, str, str], str] = TTLCache(maxsize=10_000, ttl=FILE_CACHE_TTL)
 
+# Общая HTTP-сессия для прямых загрузок (создаётся в main)
+HTTP_SESSION: Optional[aiohttp.ClientSession] = None
+THUMB_CHUNK_SIZE = 64 * 1024
 
-async def cleanup_cache() -> None:
-    """Периодически удаляет устаревшие записи из кеша."""
-    while True:
-        now = time.time()
-        expired = [k for k, v in URL_CACHE.items() if now - v["time"] > CACHE_TTL]
-        for k in expired:
-            del URL_CACHE[k]
-        await asyncio.sleep(300)  # каждые 5 минут
+URL_UPLOAD_LIMIT = 20 * 1024 * 1024  # Bot API сам скачивает по ссылке файлы до 20 МБ
+URL_UPLOAD_TIMEOUT = 120  # секунд: Telegram сначала скачивает файл сам
+
+
+# === Экземпляры yt-dlp (создаются один раз, реестр экстракторов грузится при старте) ===
+YDL_OUTTMPL = os.path.join(DOWNLOAD_DIR, "%(title)s.%(ext)s")
+VIDEO_YDL_OPTS = {
+    "quiet": True,
+    "no_warnings": True,
+    "outtmpl": YDL_OUTTMPL,
+    "noplaylist": True,
+    "format": "best",
+}
+AUDIO_YDL_OPTS = {
+    **VIDEO_YDL_OPTS,
+    "format": "bestaudio/best",
+    "postprocessors": [{
+        "key": "FFmpegExtractAudio",
+        "preferredcodec": "mp3",
+        "preferredquality": "192",
+    }],
+}
+
+# Ограниченный пул потоков и семафор, чтобы наплыв загрузок не забивал диск и сеть
+YDL_EXECUTOR = ThreadPoolExecutor(max_workers=YDL_WORKERS, thread_name_prefix="ydl")
+DL_SEM = asyncio.Semaphore(YDL_WORKERS)
+# Метаданные — в своём пуле, чтобы долгие загрузки не задерживали список форматов
+INFO_EXECUTOR = ThreadPoolExecutor(max_workers=YDL_WORKERS, thread_name_prefix="ydl-info")
+
+# extract_info меняет состояние экземпляра (счётчики, кеши экстракторов),
+# поэтому и для метаданных экземпляры выдаются из пула по одному
+INFO_YDL_OPTS = {"quiet": True, "skip_download": True, "outtmpl": YDL_OUTTMPL}
+INFO_YDLS = [yt_dlp.YoutubeDL(INFO_YDL_OPTS) for _ in range(YDL_WORKERS)]
+INFO_POOL: asyncio.Queue = asyncio.Queue()
+for _ydl in INFO_YDLS:
+    INFO_POOL.put_nowait(_ydl)
+
+# Экстракторы поддерживаемых платформ (ключи yt-dlp), прогреваются при старте
+WARM_EXTRACTORS = ("TikTok", "TikTokVM", "Youtube", "Instagram", "VK", "Pinterest")
+
+# Загрузчики меняют состояние при работе, поэтому выдаются из пула по одному
+YDL_POOLS: Dict[str, asyncio.Queue] = {"video": asyncio.Queue(), "audio": asyncio.Queue()}
+for _ in range(YDL_WORKERS):
+    YDL_POOLS["video"].put_nowait(yt_dlp.YoutubeDL(VIDEO_YDL_OPTS))
+    YDL_POOLS["audio"].put_nowait(yt_dlp.YoutubeDL(AUDIO_YDL_OPTS))
 
 
 # === Вспомогательные функции ===
-def detect_platform(url: str) -> str:
-    for key in URL_PATTERNS.keys():
-        if key in url:
-            return key.capitalize()
-    return "Unknown"
-
-
-def extract_url(text: str) -> Optional[str]:
-    for pattern in URL_PATTERNS.values():
-        m = pattern.search(text)
-        if m:
-            return m.group(0)
-    return None
+def extract_url(text: str) -> Tuple[Optional[str], str]:
+    """Находит первую поддерживаемую ссылку и платформу за один проход."""
+    # Все шаблоны начинаются с "http": сообщения без ссылок отсекаем без regex
+    if "http" not in text:
+        return None, "Unknown"
+    m = URL_COMBINED.search(text)
+    if not m:
+        return None, "Unknown"
+    return m.group(0), PLATFORM_NAMES[m.lastgroup]
+
+
+def warm_up_extractors() -> None:
+    """Импортирует нужные экстракторы и компилирует их регулярки заранее."""
+    for ydl in INFO_YDLS:
+        for key in WARM_EXTRACTORS:
+            ydl.get_info_extractor(key).suitable("")
+
+
+async def run_info_ydl(func):
+    """Выполняет ``func(ydl)`` в пуле потоков на свободном экземпляре для метаданных."""
+    ydl = await INFO_POOL.get()
+    try:
+        return await asyncio.get_running_loop().run_in_executor(INFO_EXECUTOR, func, ydl)
+    finally:
+        INFO_POOL.put_nowait(ydl)
+
+
+def compact_info(info: dict) -> dict:
+    """Убирает из метаданных всё, что не нужно для последующей загрузки."""
+    for key in UNUSED_INFO_KEYS:
+        info.pop(key, None)
+    # Раскадровки (storyboard) — mhtml-форматы, скачивать их бот не умеет
+    info["formats"] = [f for f in info.get("formats", []) if f.get("ext") != "mhtml"]
+    return info
 
 
-async def get_video_info(url: str) -> Optional[VideoInfo]:
-    """Извлекает метаданные видео без загрузки."""
-    ydl_opts = {"quiet": True, "skip_download": True}
-    loop = asyncio.get_event_loop()
+async def get_video_info(url: str) -> Optional[Tuple[VideoInfo, dict]]:
+    """Извлекает метаданные видео без загрузки.
+
+    Возвращает также сырой словарь yt-dlp, чтобы повторно использовать его
+    при загрузке без второго прохода экстрактора.
+    """
     try:
-        def _extract():
-            with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-                info = ydl.extract_info(url, download=False)
-                return VideoInfo(
-                    url=url,
-                    title=info.get("title", "Без названия"),
-                    formats=info.get("formats", []),
-                )
-        return await loop.run_in_executor(None, _extract)
+        def _extract(ydl):
+            info = ydl.extract_info(url, download=False)
+            video = VideoInfo(
+                url=url,
+                title=info.get("title", "Без названия"),
+                formats=[
+                    (f["format_id"], f["height"])
+                    for f in info.get("formats", [])
+                    if f.get("vcodec") != "none" and f.get("ext") == "mp4" and f.get("height")
+                ],
+            )
+            return video, compact_info(info)
+        return await run_info_ydl(_extract)
     except Exception as e:
         logger.error(f"Не удалось получить информацию о видео: {e}")
         return None
 
 
-async def download_media(url: str, fmt_id: Optional[str], media_type: str) -> Optional[str]:
-    """Скачивает выбранный формат видео/аудио/превью."""
-    ydl_opts = {
-        "quiet": True,
-        "no_warnings": True,
-        "outtmpl": os.path.join(DOWNLOAD_DIR, "%(title)s.%(ext)s"),
-        "noplaylist": True,
-        "format": fmt_id or "best",
-    }
+def direct_media_url(info: Optional[dict], fmt_id: str) -> Optional[str]:
+    """Возвращает прямую ссылку на mp4, которую Telegram может забрать сам.
+
+    Подходят только одиночные http(s)-файлы со звуком, известным размером
+    не больше ``URL_UPLOAD_LIMIT`` и без обязательных cookies.
+    """
+    if not info:
+        return None
+    if fmt_id == "best":
+        fmt = info
+    else:
+        fmt = next((f for f in info.get("formats", []) if f.get("format_id") == fmt_id), None)
+    if not fmt or not fmt.get("url") or fmt.get("cookies"):
+        return None
+    size = fmt.get("filesize") or fmt.get("filesize_approx")
+    if (
+        fmt.get("protocol") in ("http", "https")
+        and fmt.get("ext") == "mp4"
+        and fmt.get("acodec") != "none"
+        and size
+        and size <= URL_UPLOAD_LIMIT
+    ):
+        return fmt["url"]
+    return None
 
-    if media_type == "audio":
-        ydl_opts.update({
-            "format": "bestaudio/best",
-            "postprocessors": [{
-                "key": "FFmpegExtractAudio",
-                "preferredcodec": "mp3",
-                "preferredquality": "192",
-            }]
-        })
-    elif media_type == "thumbnail":
-        ydl_opts.update({"skip_download": True, "writethumbnail": True})
 
-    loop = asyncio.get_event_loop()
+async def download_thumbnail(thumb_url: str, path: str) -> Optional[str]:
+    """Скачивает превью напрямую по ссылке, минуя yt-dlp."""
     try:
-        def _download():
-            with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-                info = ydl.extract_info(url, download=True)
-                if media_type == "thumbnail":
-                    return ydl.prepare_filename(info).rsplit(".", 1)[0] + ".jpg"
-                return ydl.prepare_filename(info)
-        return await loop.run_in_executor(None, _download)
+        async with HTTP_SESSION.get(thumb_url) as resp:
+            resp.raise_for_status()
+            async with aiofiles.open(path, "wb") as f:
+                async for chunk in resp.content.iter_chunked(THUMB_CHUNK_SIZE):
+                    await f.write(chunk)
+        return path
     except Exception as e:
-        logger.error(f"Ошибка загрузки: {e}")
+        logger.error(f"Ошибка загрузки превью: {e}")
         return None
 
 
+async def download_media(
+    url: str, fmt_id: Optional[str], media_type: str, info: Optional[dict] = None
+) -> Optional[str]:
+    """Скачивает выбранный формат видео/аудио/превью.
+
+    Если передан ``info`` из предыдущего ``get_video_info``, повторное
+    извлечение метаданных не выполняется.
+    """
+    loop = asyncio.get_running_loop()
+    async with DL_SEM:
+        if media_type == "thumbnail":
+            try:
+                def _thumbnail(ydl):
+                    meta = info or ydl.extract_info(url, download=False)
+                    path = ydl.prepare_filename(meta).rsplit(".", 1)[0] + ".jpg"
+                    return meta.get("thumbnail"), path
+                thumb_url, path = await run_info_ydl(_thumbnail)
+            except Exception as e:
+                logger.error(f"Ошибка загрузки: {e}")
+                return None
+            if not thumb_url:
+                logger.error("У видео нет превью.")
+                return None
+            return await download_thumbnail(thumb_url, path)
+
+        pool = YDL_POOLS["audio" if media_type == "audio" else "video"]
+        ydl = await pool.get()
+        try:
+            def _download():
+                if media_type != "audio":
+                    # params["format"] читается только в конструкторе — меняем сам селектор
+                    ydl.format_selector = ydl.build_format_selector(fmt_id or "best")
+                if info is not None:
+                    # Как в --load-info-json: без результатов прошлого выбора формата
+                    clean = ydl.sanitize_info(info, remove_private_keys=True)
+                    result = ydl.process_ie_result(clean, download=True)
+                else:
+                    result = ydl.extract_info(url, download=True)
+                return ydl.prepare_filename(result)
+            return await loop.run_in_executor(YDL_EXECUTOR, _download)
+        except Exception as e:
+            logger.error(f"Ошибка загрузки: {e}")
+            return None
+        finally:
+            pool.put_nowait(ydl)
+
+
 # === Inline-клавиатуры ===
+# Кнопки выбора типа собираются один раз; для каждой ссылки меняется только callback_data
+TYPE_BUTTONS = (
+    ("video", InlineKeyboardButton(text="🎞 Видео")),
+    ("audio", InlineKeyboardButton(text="🎧 Аудио")),
+    ("thumbnail", InlineKeyboardButton(text="🖼 Превью")),
+)
+
+
 def build_type_keyboard(url: str) -> InlineKeyboardMarkup:
-    uid = str(uuid.uuid4())[:8]
-    URL_CACHE[uid] = {"url": url, "time": time.time()}
+    uid = secrets.token_urlsafe(6)
+    URL_CACHE[uid] = {"url": url}
+    row = [
+        button.model_copy(update={"callback_data": TypeCB(media_type=media_type, uid=uid).pack()})
+        for media_type, button in TYPE_BUTTONS
+    ]
+    return InlineKeyboardMarkup(inline_keyboard=[row])
+
+
+def build_quality_keyboard(
+    formats: List[Tuple[str, int]], media_type: str, uid: str
+) -> InlineKeyboardMarkup:
+    # yt-dlp сортирует форматы от худшего к лучшему: для каждой высоты остаётся лучший
+    by_height = {h: fid for fid, h in formats}
+    quality_buttons = [
+        InlineKeyboardButton(
+            text=f"{h}p",
+            callback_data=DlCB(media_type=media_type, fmt_id=fid, uid=uid).pack(),
+        )
+        for h, fid in sorted(by_height.items())
+    ]
+    if not quality_buttons:
+        quality_buttons.append(
+            InlineKeyboardButton(
+                text="Лучшее доступное",
+                callback_data=DlCB(media_type=media_type, fmt_id="best", uid=uid).pack(),
+            )
+        )
+    rows = [quality_buttons[i:i + 3] for i in range(0, len(quality_buttons), 3)]
+    return InlineKeyboardMarkup(inline_keyboard=rows)
+
+
+def build_download_keyboard(media_type: str, uid: str) -> InlineKeyboardMarkup:
     return InlineKeyboardMarkup(
         inline_keyboard=[
             [
-                InlineKeyboardButton(text="🎞 Видео", callback_data=f"type|video|{uid}"),
-                InlineKeyboardButton(text="🎧 Аудио", callback_data=f"type|audio|{uid}"),
-                InlineKeyboardButton(text="🖼 Превью", callback_data=f"type|thumbnail|{uid}"),
+                InlineKeyboardButton(
+                    text="⬇️ Скачать",
+                    callback_data=DlCB(media_type=media_type, fmt_id="best", uid=uid).pack(),
+                )
             ]
         ]
     )
 
 
-def build_quality_keyboard(formats: List[dict], media_type: str, uid: str) -> InlineKeyboardMarkup:
-    quality_buttons = []
-    for f in formats:
-        if f.get("vcodec") != "none" and f.get("ext") == "mp4" and f.get("height"):
-            q = f.get("format_id")
-            label = f"{f.get('height')}p"
-            quality_buttons.append(
-                InlineKeyboardButton(text=label, callback_data=f"dl|{media_type}|{q}|{uid}")
-            )
-    if not quality_buttons:
-        quality_buttons.append(
-            InlineKeyboardButton(text="Лучшее доступное", callback_data=f"dl|{media_type}|best|{uid}")
-        )
-    rows = [quality_buttons[i:i + 3] for i in range(0, len(quality_buttons), 3)]
-    return InlineKeyboardMarkup(inline_keyboard=rows)
+# === Отправка файлов ===
+async def send_media(message: Message, media_type: str, media) -> Message:
+    """Отправляет файл, ссылку или file_id подходящим методом."""
+    if media_type == "audio":
+        return await message.answer_audio(media)
+    if media_type == "thumbnail":
+        return await message.answer_photo(media)
+    return await message.answer_video(media)
+
+
+def remember_file_id(key: Tuple[str, str, str], sent: Message, media_type: str) -> None:
+    """Запоминает file_id отправленного файла для повторных запросов."""
+    if media_type == "audio":
+        media = sent.audio
+    elif media_type == "thumbnail":
+        media = sent.photo[-1] if sent.photo else None
+    else:
+        media = sent.video
+    if media:
+        FILE_CACHE[key] = media.file_id
+
+
+async def delete_status_message(message: Message) -> None:
+    """Удаляет служебное сообщение; при двойном нажатии его уже может не быть."""
+    with suppress(TelegramBadRequest):
+        await message.delete()
 
 
 # === Обработчики ===
@@ -186,11 +403,10 @@ async def cmd_start(msg: Message):
 
 
 async def handle_link(msg: Message):
-    url = extract_url(msg.text or "")
+    url, platform = extract_url(msg.text or "")
     if not url:
         await msg.answer("❗ Не удалось найти ссылку.")
         return
-    platform = detect_platform(url)
     await msg.answer(
         f"📦 Найдено: <b>{platform}</b>\nВыбери тип загрузки:",
         parse_mode=ParseMode.HTML,
@@ -198,19 +414,29 @@ async def handle_link(msg: Message):
     )
 
 
-async def cb_select_type(call: CallbackQuery):
-    _, media_type, uid = call.data.split("|", 2)
-    entry = URL_CACHE.get(uid)
-    if not entry:
+async def cb_select_type(call: CallbackQuery, callback_data: TypeCB):
+    media_type, uid = callback_data.media_type, callback_data.uid
+    try:
+        entry = URL_CACHE[uid]
+    except KeyError:
         await call.message.edit_text("⚠️ Сессия устарела. Отправь ссылку заново.")
         return
     url = entry["url"]
 
+    # Аудио и превью не зависят от выбранного формата — метаданные не нужны
+    if media_type in ("audio", "thumbnail"):
+        await call.message.edit_text(
+            "Нажми, чтобы начать загрузку:",
+            reply_markup=build_download_keyboard(media_type, uid),
+        )
+        return
+
     await call.message.edit_text("⏳ Получаю список форматов...")
-    info = await get_video_info(url)
-    if not info:
+    result = await get_video_info(url)
+    if not result:
         await call.message.edit_text("🚫 Не удалось получить информацию о видео.")
         return
+    info, entry["info"] = result
 
     kb = build_quality_keyboard(info.formats, media_type, uid)
     await call.message.edit_text(
@@ -220,51 +446,100 @@ async def cb_select_type(call: CallbackQuery):
     )
 
 
-async def cb_download(call: CallbackQuery):
-    _, media_type, fmt_id, uid = call.data.split("|", 3)
-    entry = URL_CACHE.get(uid)
-    if not entry:
+async def cb_download(call: CallbackQuery, callback_data: DlCB):
+    media_type, fmt_id, uid = callback_data.media_type, callback_data.fmt_id, callback_data.uid
+    try:
+        entry = URL_CACHE[uid]
+    except KeyError:
         await call.message.edit_text("⚠️ Сессия устарела. Отправь ссылку заново.")
         return
     url = entry["url"]
 
+    # Тот же файл уже отправлялся — Telegram хранит его, достаточно file_id
+    key = (url, fmt_id, media_type)
+    file_id = FILE_CACHE.get(key)
+    if file_id:
+        try:
+            await send_media(call.message, media_type, file_id)
+        except TelegramBadRequest as e:
+            logger.info(f"Сохранённый file_id не подошёл, загружаю заново: {e}")
+            FILE_CACHE.pop(key, None)
+        except Exception as e:
+            logger.error(f"Ошибка отправки файла: {e}")
+            await call.message.edit_text("⚠️ Ошибка при отправке файла.")
+            return
+        else:
+            FILE_CACHE[key] = file_id  # продлеваем срок жизни записи
+            await delete_status_message(call.message)
+            return
+
+    # Маленькие прямые mp4 отдаём Telegram ссылкой — без скачивания и повторной выгрузки
+    direct_url = direct_media_url(entry.get("info"), fmt_id) if media_type == "video" else None
+    if direct_url:
+        try:
+            sent = await call.message.answer_video(direct_url, request_timeout=URL_UPLOAD_TIMEOUT)
+        except TelegramBadRequest as e:
+            # Telegram отказался забирать ссылку — скачиваем сами
+            logger.info(f"Telegram не смог загрузить файл по ссылке, скачиваю сам: {e}")
+        except Exception as e:
+            # Таймаут и прочие ошибки: Telegram мог всё же отправить видео, не дублируем
+            logger.error(f"Ошибка отправки файла по ссылке: {e}")
+            await call.message.edit_text("⚠️ Ошибка при отправке файла.")
+            return
+        else:
+            remember_file_id(key, sent, media_type)
+            await delete_status_message(call.message)
+            return
+
     await call.message.edit_text("⬇️ Загружаю файл, подожди немного...")
-    path = await download_media(url, fmt_id, media_type)
-    if not path or not os.path.exists(path):
+    path = await download_media(url, fmt_id, media_type, entry.get("info"))
+    if not path:
         await call.message.edit_text("🚫 Ошибка загрузки.")
         return
 
     try:
-        file = FSInputFile(path)
-        if media_type == "audio":
-            await call.message.answer_audio(file)
-        elif media_type == "thumbnail":
-            await call.message.answer_photo(file)
-        else:
-            await call.message.answer_video(file)
-        await call.message.delete()
+        sent = await send_media(call.message, media_type, FSInputFile(path))
+        remember_file_id(key, sent, media_type)
     except Exception as e:
         logger.error(f"Ошибка отправки файла: {e}")
         await call.message.edit_text("⚠️ Ошибка при отправке файла.")
+    else:
+        await delete_status_message(call.message)
     finally:
         try:
-            os.remove(path)
+            await asyncio.get_running_loop().run_in_executor(None, os.unlink, path)
         except Exception:
             pass
 
 
 # === Запуск бота ===
 async def main():
-    bot = Bot(token=BOT_TOKEN, default=DefaultBotProperties(parse_mode=ParseMode.HTML))
+    global HTTP_SESSION
+    # Держим соединения с Bot API открытыми между запросами (по умолчанию aiohttp — 15 с)
+    session = AiohttpSession(limit=100)
+    session._connector_init.update(keepalive_timeout=75)
+    bot = Bot(
+        token=BOT_TOKEN,
+        session=session,
+        default=DefaultBotProperties(parse_mode=ParseMode.HTML),
+    )
     dp = Dispatcher()
     dp.message.register(cmd_start, CommandStart())
     dp.message.register(handle_link)
-    dp.callback_query.register(cb_select_type, lambda c: c.data.startswith("type|"))
-    dp.callback_query.register(cb_download, lambda c: c.data.startswith("dl|"))
+    dp.callback_query.register(cb_select_type, TypeCB.filter())
+    dp.callback_query.register(cb_download, DlCB.filter())
 
-    asyncio.create_task(cleanup_cache())  # фоновая очистка кеша
+    try:
+        await asyncio.get_running_loop().run_in_executor(INFO_EXECUTOR, warm_up_extractors)
+    except Exception as e:
+        logger.warning(f"Не удалось прогреть экстракторы: {e}")
+
+    HTTP_SESSION = aiohttp.ClientSession()
     logger.info("Бот запущен.")
-    await dp.start_polling(bot)
+    try:
+        await dp.start_polling(bot)
+    finally:
+        await HTTP_SESSION.close()
 
 
 if __name__ == "__main__":